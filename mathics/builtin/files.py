@@ -7,6 +7,9 @@ File Operations
 from __future__ import with_statement
 import os
 import io
+import re
+import mmap
+import codecs
 import shutil
 import hashlib
 import zlib
@@ -14,12 +17,17 @@ import base64
 import sys
 import tempfile
 import time
+import datetime
+import threading
 
-from mathics.core.expression import Expression, String, Symbol, from_python
+from mathics.core.expression import Expression, String, Symbol, Integer, from_python
 from mathics.builtin.base import Builtin, Predefined, BinaryOperator, PrefixOperator
+from mathics.builtin.datentime import EPOCH_START, total_seconds
 from mathics.settings import ROOT_DIR
 
-STREAMS = {}
+STREAMS = []        # Python repr
+_STREAMS = []       # Mathics repr
+STREAMS_LOCK = threading.Lock()
 INITIAL_DIR = os.getcwd()
 HOME_DIR = os.path.expanduser('~')
 SYS_ROOT_DIR = '/' if os.name == 'posix' else '\\'
@@ -28,6 +36,11 @@ DIRECTORY_STACK = [INITIAL_DIR]
 INPUT_VAR = ""
 INPUTFILE_VAR = ""
 PATH_VAR = [HOME_DIR, os.path.join(ROOT_DIR, 'data')]
+WRITE_BUFFER_SIZE = 1 << 16     # Coalesce small writes to output streams
+MMAP_THRESHOLD = 1 << 20        # Map files at least this large instead of reading them
+
+# Offset of the system epoch from the one used by AbsoluteTime
+EPOCH_OFFSET = total_seconds(datetime.datetime(*time.gmtime(0)[:6]) - EPOCH_START)
 
 class mathics_open:
     def __init__(self, filename, mode='r'):
@@ -39,11 +52,12 @@ class mathics_open:
         path = path_search(self.filename)
 
         encoding = 'utf-8' if 'b' not in self.mode else None
+        buffering = WRITE_BUFFER_SIZE if self.mode[0] in 'wa' else -1
 
         if path is not None:
-            self.file = io.open(path, self.mode, encoding=encoding)
+            self.file = io.open(path, self.mode, buffering, encoding=encoding)
         elif self.mode == 'w':
-            self.file = io.open(self.filename, self.mode, encoding=encoding)
+            self.file = io.open(self.filename, self.mode, buffering, encoding=encoding)
         return self
 
     def __exit__(self, type, value, traceback):
@@ -86,18 +100,256 @@ def path_search(filename):
     return None
 
 def _put_stream(stream):
-    global STREAMS, _STREAMS, NSTREAMS
+    # Stream numbers are 1-based indices into STREAMS and _STREAMS. They
+    # are never reused, so a stale handle cannot address a newer stream.
+    with STREAMS_LOCK:
+        STREAMS.append(stream)
+        _STREAMS.append(None)
+        return len(STREAMS)
+
+def _get_stream(n):
+    if n is not None and 0 < n <= len(STREAMS):
+        return STREAMS[n - 1]
+    return None
+
+def _close_stream(n):
+    STREAMS[n - 1] = None
+    _STREAMS[n - 1] = None
+
+WORD_CHUNK = 256        # Initial block size (in characters) for word reads
+NUMBER_CHARS = u'+-.0123456789'
+REAL_CHARS = NUMBER_CHARS + u'eE^*'
+
+WORD_PATTERNS = {}
+
+def _word_pattern(separators, accepted=None):
+    """
+    Returns a compiled pattern which skips leading separators, captures a
+    token (group 1) and then the separator ending it, if any (group 2).
+    Patterns are cached, so each tokenizer is only compiled once.
+    """
+    key = (tuple(separators), accepted)
+    pattern = WORD_PATTERNS.get(key)
+    if pattern is None:
+        pattern = WORD_PATTERNS[key] = _compile_word_pattern(separators, accepted)
+    return pattern
+
+def _compile_word_pattern(separators, accepted):
+    separators = [s for s in separators if s]
+    singles = set(s for s in separators if len(s) == 1)
+    if singles and all(c in singles for s in separators for c in s):
+        # The separators come down to a set of characters (e.g. "\r\n"
+        # is covered by "\r" and "\n"), so test them with a character
+        # class, i.e. a table lookup, instead of an alternation per char.
+        seps = re.escape(u''.join(sorted(singles)))
+        if accepted is None:
+            char = u'[^%s]' % seps
+        else:
+            accepted = u''.join(c for c in accepted if c not in singles)
+            char = u'[%s]' % re.escape(accepted) if accepted else u'[^\s\S]'
+        return re.compile(u'[%s]*(%s*)([%s])?' % (seps, char, seps), re.DOTALL)
+
+    char = u'[%s]' % re.escape(accepted) if accepted is not None else u'.'
+    seps = [re.escape(s) for s in sorted(separators, key=len, reverse=True)]
+    if not seps:
+        return re.compile(u'(%s*)' % char, re.DOTALL)
+    sep = u'|'.join(seps)
+    return re.compile(u'(?:%s)*((?:(?!%s)%s)*)(%s)?' % (sep, sep, char, sep), re.DOTALL)
+
+class _BlockReader(object):
+    """
+    Reads tokens from text buffered in geometrically growing blocks from
+    stream, instead of going back to the stream for every character.
+
+    Once done, finish() leaves the stream positioned directly after the
+    text which was consumed.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.start = stream.tell()
+        self.text = u''
+        self.pos = 0
+        self.chunk = WORD_CHUNK
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        tmp = self.stream.read(self.chunk)
+        self.eof = len(tmp) < self.chunk
+        self.chunk *= 2
+        self.text += tmp
+        return tmp != ''
+
+    def read(self, k):
+        while len(self.text) - self.pos < k and self.fill():
+            pass
+        result = self.text[self.pos:self.pos + k]
+        self.pos += len(result)
+        return result
+
+    def readline(self):
+        end = self.text.find(u'\n', self.pos)
+        while end == -1:
+            searched = len(self.text)
+            if not self.fill():
+                end = len(self.text)
+                break
+            end = self.text.find(u'\n', searched)
+        else:
+            end += 1
+        result = self.text[self.pos:end]
+        self.pos = end
+        return result
+
+    def read_word(self, pattern):
+        """
+        Reads the next token matching pattern (see _word_pattern). A
+        character which is not accepted ends the token and is consumed,
+        a separator ending it is not.
+        """
+        while True:
+            match = pattern.match(self.text, self.pos)
+            end = match.end(1)
+            if end < len(self.text) or not self.fill():
+                break
+
+        word = match.group(1)
+        if end == len(self.text):
+            self.pos = end
+            if word == '':
+                raise EOFError
+            return word
+
+        if pattern.groups < 2 or match.group(2) is None:
+            end += 1
+        self.pos = end
+        return word
+
+    def finish(self):
+        if self.pos < len(self.text):
+            self.stream.seek(self.start)
+            self.stream.read(self.pos)
+
+class ReadFailed(Exception):
+    """
+    Raised by the _read_* functions when the input does not have the form
+    of the requested type. tag names the Read message to issue.
+    """
+
+    def __init__(self, tag, *args):
+        Exception.__init__(self, *args)
+        self.tag = tag
+
+def _read_byte(reader, patterns):
+    tmp = reader.read(1)
+    if tmp == '':
+        raise EOFError
+    return ord(tmp)
+
+def _read_character(reader, patterns):
+    tmp = reader.read(1)
+    if tmp == '':
+        raise EOFError
+    return tmp
+
+def _read_expression(reader, patterns):
+    from mathics.core.parser import parse, ParseError
 
+    tmp = reader.read_word(patterns['Record'])
     try:
-        _STREAMS
-    except NameError:
-        STREAMS = {}    # Python repr
-        _STREAMS = {}   # Mathics repr
-        NSTREAMS = 0    # Max stream number
+        expr = parse(tmp)
+    except ParseError:
+        expr = None
+    if expr is None:
+        raise ReadFailed('readt', tmp)
+    return tmp
+
+def _read_number(reader, patterns):
+    tmp = reader.read_word(patterns['Number'])
+    try:
+        return int(tmp)
+    except ValueError:
+        try:
+            return float(tmp)
+        except ValueError:
+            raise ReadFailed('readn')
 
-    NSTREAMS += 1
-    STREAMS[NSTREAMS] = stream
-    return NSTREAMS
+def _read_real(reader, patterns):
+    tmp = reader.read_word(patterns['Real'])
+    tmp = tmp.replace('*^', 'E')
+    try:
+        return float(tmp)
+    except ValueError:
+        raise ReadFailed('readn')
+
+def _read_record(reader, patterns):
+    return reader.read_word(patterns['Record'])
+
+def _read_string(reader, patterns):
+    tmp = reader.readline()
+    if len(tmp) == 0:
+        raise EOFError
+    return tmp
+
+def _read_word(reader, patterns):
+    return reader.read_word(patterns['Word'])
+
+READ_FUNCTIONS = {
+    'Byte': _read_byte,
+    'Character': _read_character,
+    'Expression': _read_expression,
+    'Number': _read_number,
+    'Real': _read_real,
+    'Record': _read_record,
+    'String': _read_string,
+    'Word': _read_word,
+}
+READ_TYPES = frozenset(READ_FUNCTIONS)
+
+def _batch_read(paths):
+    """
+    Returns the complete (decoded) contents of each file in paths.
+    """
+    result = []
+    for path in paths:
+        # Read the raw bytes in one go and decode once, bypassing the
+        # buffered text layer which would copy and decode chunkwise.
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size >= MMAP_THRESHOLD:
+                # Decode straight from the mapped pages, so the file is
+                # never copied into an intermediate bytes object.
+                mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+                try:
+                    result.append(codecs.utf_8_decode(mm, 'strict', True)[0])
+                finally:
+                    mm.close()
+            else:
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                chunks = [os.read(fd, size)]
+                # st_size is only a hint (e.g. files still being written)
+                while True:
+                    tmp = os.read(fd, max(size, 4096))
+                    if not tmp:
+                        break
+                    chunks.append(tmp)
+                result.append(''.join(chunks).decode('utf-8'))
+        finally:
+            os.close(fd)
+    return result
+
+LINE_PATTERN = re.compile(u'[^\n]*\n|[^\n]+')
+
+def _split_lines(text):
+    """
+    Splits text like successive readline() calls would, i.e. keeping
+    the trailing newline of each line.
+    """
+    return LINE_PATTERN.findall(text)
 
 
 class InitialDirectory(Predefined):
@@ -114,7 +366,6 @@ class InitialDirectory(Predefined):
     name = '$InitialDirectory'
 
     def evaluate(self, evaluation):
-        global INITIAL_DIR
         return String(INITIAL_DIR)
 
 
@@ -132,7 +383,6 @@ class InstallationDirectory(Predefined):
     name = '$InstallationDirectory'
 
     def evaluate(self, evaluation):
-        global ROOT_DIR
         return String(ROOT_DIR)
 
 
@@ -152,7 +402,6 @@ class HomeDirectory(Predefined):
     attributes = ('Protected')
 
     def evaluate(self, evaluation):
-        global HOME_DIR
         return String(HOME_DIR)
 
 
@@ -172,7 +421,6 @@ class RootDirectory(Predefined):
     attributes = ('Protected')
 
     def evaluate(self, evaluation):
-        global SYS_ROOT_DIR
         return String(SYS_ROOT_DIR)
 
 
@@ -208,7 +456,6 @@ class Input(Predefined):
     name = '$Input'
 
     def evaluate(self, evaluation):
-        global INPUT_VAR
         return String(INPUT_VAR)
 
 
@@ -227,7 +474,6 @@ class InputFileName(Predefined):
     name = '$InputFileName'
 
     def evaluate(self, evaluation):
-        global INPUTFILE_VAR
         return String(INPUTFILE_VAR)
 
 
@@ -333,6 +579,32 @@ class Read(Builtin):
     #> Read[str, Word]
      = EndOfFile
     #> Close[str];
+    #> str = StringToStream["a b  c"];
+    #> Read[str, {Word, Word, Word}]
+     = {a, b, c}
+    #> Close[str];
+    #> str = StringToStream[StringJoin[Table["x", {1000}]] <> " y"];
+    #> StringLength[Read[str, Word]]
+     = 1000
+    #> Read[str, Word]
+     = y
+    #> Close[str];
+
+    ## Character and Byte
+    #> str = StringToStream["abc"];
+    #> Read[str, Byte]
+     = 97
+    #> Read[str, {Byte, Byte}]
+     = {98, 99}
+    #> Read[str, Byte]
+     = EndOfFile
+    #> Close[str];
+    #> str = StringToStream["abc"];
+    #> Read[str, {Character, Byte}]
+     = {a, 98}
+    #> Read[str, {Character, Character}]
+     = EndOfFile
+    #> Close[str];
 
     ## Number
     >> str = StringToStream["123, 4"];
@@ -481,9 +753,7 @@ class Read(Builtin):
 
     def apply(self, name, n, types, evaluation, options):
         'Read[InputStream[name_, n_], types_, OptionsPattern[Read]]'
-        global STREAMS
-    
-        stream = STREAMS.get(n.to_python())
+        stream = _get_stream(n.get_int_value())
 
         if stream is None:
             evaluation.message('Read', 'openx', Expression('InputSteam', name, n))
@@ -493,13 +763,21 @@ class Read(Builtin):
         if not isinstance(types, list):
             types = [types]
     
-        READ_TYPES = ['Byte', 'Character', 'Expression', 'Number', 'Real', 'Record', 'String', 'Word']
-
         for typ in types:
             if not (isinstance(typ, basestring) and typ in READ_TYPES):
                 evaluation.message('Read', 'readf', from_python(typ))
                 return Symbol('$Failed')
 
+        # Only Bytes: read them straight from the stream in a single call
+        if all(typ == 'Byte' for typ in types):
+            tmp = stream.read(len(types))
+            if len(tmp) < len(types):
+                return Symbol('EndOfFile')
+            result = [Integer(ord(c)) for c in tmp]
+            if len(result) == 1:
+                return result[0]
+            return Expression('List', *result)
+
         ## Options:
         #TODO: Implement extra options
         py_options = self.check_options(options)
@@ -509,99 +787,25 @@ class Read(Builtin):
         #token_words = py_options['TokenWords']
         word_separators = py_options['WordSeparators']
 
-        name = name.to_python()
+        patterns = {
+            'Word': _word_pattern(word_separators),
+            'Record': _word_pattern(record_separators),
+            'Number': _word_pattern(word_separators + record_separators, NUMBER_CHARS),
+            'Real': _word_pattern(word_separators + record_separators, REAL_CHARS),
+        }
 
         result = []
-
-        def reader(stream, word_separators, accepted = None):
-            while True:
-                word = ''
-                while True:
-                    tmp = stream.read(1)
-
-                    if tmp == '':
-                        if word == '':
-                            raise EOFError
-                        yield word
-
-                    if tmp in word_separators:
-                        if word == '':
-                            break
-                        if stream.seekable():
-                            # stream.seek(-1, 1) #Python3
-                            stream.seek(stream.tell()-1)
-                        yield word
-
-                    if accepted is not None and tmp not in accepted:
-                        yield word
-
-                    word += tmp
-
-        read_word = reader(stream, word_separators)
-        read_record = reader(stream, record_separators)
-        read_number = reader(stream, word_separators + record_separators, 
-            ['+', '-', '.'] + [str(i) for i in range(10)])
-        read_real = reader(stream, word_separators + record_separators,
-            ['+', '-', '.', 'e', 'E', '^', '*'] + [str(i) for i in range(10)])
-        for typ in types:
-            try:
-                if typ == 'Byte':
-                    tmp = stream.read(1)
-                    if tmp == '':
-                        raise EOFError
-                    result.append(ord(tmp))
-                elif typ == 'Character':
-                    tmp = stream.read(1)
-                    if tmp == '':
-                        raise EOFError
-                    result.append(tmp)
-                elif typ == 'Expression':
-                    tmp = read_record.next()
-                    try:
-                        try:
-                            expr = parse(tmp)
-                        except NameError:
-                            from mathics.core.parser import parse, ParseError
-                            expr = parse(tmp)
-                    except ParseError:
-                        expr = None
-                    if expr is None:
-                        evaluation.message('Read', 'readt', tmp, Expression('InputSteam', name, n))
-                        return Symbol('$Failed')
-                    result.append(tmp)
-                elif typ == 'Number':
-                    tmp = read_number.next()
-                    try:
-                        tmp = int(tmp)
-                    except ValueError:
-                        try:
-                            tmp = float(tmp)
-                        except ValueError:
-                            evaluation.message('Read', 'readn', Expression('InputSteam', name, n))
-                            return Symbol('$Failed')
-                    result.append(tmp)
-                        
-                elif typ == 'Real':
-                    tmp = read_real.next()
-                    tmp = tmp.replace('*^', 'E')
-                    try:
-                        tmp = float(tmp)
-                    except ValueError:
-                        evaluation.message('Read', 'readn', Expression('InputSteam', name, n))
-                        return Symbol('$Failed')
-                    result.append(tmp)
-                elif typ == 'Record':
-                    result.append(read_record.next())
-                elif typ == 'String':
-                    tmp = stream.readline()
-                    if len(tmp) == 0:
-                        raise EOFError
-                    result.append(tmp)
-                elif typ == 'Word':
-                    result.append(read_word.next())
-                        
-            except EOFError:
-                return Symbol('EndOfFile')
+        reader = _BlockReader(stream)
+        try:
+            for typ in types:
+                result.append(READ_FUNCTIONS[typ](reader, patterns))
+        except EOFError:
+            return Symbol('EndOfFile')
+        except ReadFailed, exc:
+            evaluation.message('Read', exc.tag, *(exc.args + (Expression('InputSteam', name, n),)))
+            return Symbol('$Failed')
+        finally:
+            reader.finish()
 
         if len(result) == 1:
             return from_python(*result)
@@ -631,16 +835,32 @@ class Write(Builtin):
     >> ReadList[str]
      = {10 x + 15 y ^ 2, 3 Sin[z]}
     #> Close[str];
+
+    #> str = OpenWrite[];
+    #> Write[str, "abc", "def"]
+    #> Write[str, "ghi", x]
+    #> FilePrint[Close[str]]
+     | abcdef
+     | ghix
     """
 
     attributes = ('Protected')
 
     def apply(self, name, n, expr, evaluation):
         'Write[OutputStream[name_, n_], expr___]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
+
+        if stream is None:
+            evaluation.message('General', 'openx', name)
+            return
 
         expr = expr.get_sequence()
+
+        # Strings are written verbatim, so skip the formatter for them
+        if all(isinstance(e, String) for e in expr):
+            stream.write(u''.join(e.value for e in expr) + u'\n')
+            return Symbol('Null')
+
         expr = Expression('Row', Expression('List', *expr))
 
         evaluation.format = 'text'
@@ -680,18 +900,20 @@ class WriteString(Builtin):
 
     def apply(self, name, n, expr, evaluation):
         'WriteString[OutputStream[name_, n_], expr___]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
 
-        exprs = expr.get_sequence()
-        for e in exprs:
+        if stream is None:
+            evaluation.message('General', 'openx', name)
+            return
+
+        parts = []
+        for e in expr.get_sequence():
             if not isinstance(e, String):
                 evaluation.message('WriteString', 'strml', e) # Mathematica gets this message wrong
                 return
+            parts.append(e.value)
 
-        text = map(lambda x: x.to_python()[1:-1], exprs)
-        text = unicode(''.join(text))
-        stream.write(text)
+        stream.write(u''.join(parts))
         return Symbol('Null')
 
 
@@ -707,11 +929,11 @@ class _OpenAction(Builtin):
     def apply(self, path, evaluation):
         '%(name)s[path_]'
 
-        if not (isinstance(path, String) and len(path.to_python()) > 2):
+        if not (isinstance(path, String) and path.value):
             evaluation.message(self.__class__.__name__, 'fstr', path)
             return
 
-        path_string = path.to_python()[1:-1]
+        path_string = path.value
 
         tmp = path_search(path_string)
         if tmp is None:
@@ -729,8 +951,7 @@ class _OpenAction(Builtin):
 
         n = _put_stream(stream)
         result = Expression(self.stream_type, path, n)
-        global _STREAMS
-        _STREAMS[n] = result
+        _STREAMS[n - 1] = result
 
         return result
 
@@ -741,8 +962,6 @@ class _OpenAction(Builtin):
             evaluation.message(self.__class__.__name__, 'argx')
             return
 
-        global TMP_DIR
-
         tmpf = tempfile.NamedTemporaryFile(dir=TMP_DIR)
         path_string = tmpf.name
         tmpf.close()
@@ -755,8 +974,7 @@ class _OpenAction(Builtin):
 
         n = _put_stream(stream)
         result = Expression(self.stream_type, String(path_string), n)
-        global _STREAMS
-        _STREAMS[n] = result
+        _STREAMS[n - 1] = result
 
         return result
 
@@ -943,8 +1161,7 @@ class Put(BinaryOperator):
 
     def apply_input(self, exprs, name, n, evaluation):
         'Put[exprs___, OutputStream[name_, n_]]'
-        global STREAMS
-        stream = STREAMS.get(n.to_python())
+        stream = _get_stream(n.get_int_value())
 
         if stream is None:
             evaluation.message('Put', 'openx', Expression('OutputSteam', name, n))
@@ -967,7 +1184,7 @@ class Put(BinaryOperator):
     def parse(self, args):
         if isinstance(args[2], Symbol):
             ptokens = args[2].parse_tokens
-            args[2] = String(args[2])
+            args[2] = String(args[2].get_name())
             args[2].parse_tokens = ptokens
 
         return super(Put, self).parse(args)
@@ -1025,8 +1242,7 @@ class PutAppend(BinaryOperator):
 
     def apply_input(self, exprs, name, n, evaluation):
         'PutAppend[exprs___, OutputStream[name_, n_]]'
-        global STREAMS
-        stream = STREAMS.get(n.to_python())
+        stream = _get_stream(n.get_int_value())
 
         if stream is None:
             evaluation.message('Put', 'openx', Expression('OutputSteam', name, n))
@@ -1049,7 +1265,7 @@ class PutAppend(BinaryOperator):
     def parse(self, args):
         if isinstance(args[2], Symbol):
             ptokens = args[2].parse_tokens
-            args[2] = String(args[2])
+            args[2] = String(args[2].get_name())
             args[2].parse_tokens = ptokens
 
         return super(PutAppend, self).parse(args)
@@ -1456,6 +1672,14 @@ class ReadList(Read):
     >> InputForm[%]
      = {"abc123"}
     #> Close[str];
+
+    #> str = StringToStream["abc 123"];
+    #> Read[str, Word];
+    #> InputForm[ReadList[str, String]]
+     = {" 123"}
+    #> ReadList[str, String]
+     = {}
+    #> Close[str];
     """
 
     #TODO: Accept newlines in input
@@ -1492,10 +1716,16 @@ class ReadList(Read):
         #token_words = py_options['TokenWords']
         word_separators = py_options['WordSeparators']
 
+        if types.get_name() == 'String':
+            stream = _get_stream(n.get_int_value())
+            if stream is not None:
+                lines = _split_lines(stream.read())
+                return Expression('List', *[String(line) for line in lines])
+
         result = []
         while True:
             tmp = super(ReadList, self).apply(name, n, types, evaluation, options)
-            if tmp.to_python() == 'EndOfFile':
+            if tmp.get_name() == 'EndOfFile':
                 break
             result.append(tmp)
         return from_python(result)
@@ -1564,9 +1794,8 @@ class FilePrint(Builtin):
             return Symbol("$Failed")
 
         try:
-            with mathics_open(pypath, 'r') as f:
-                result = f.read()
-        except IOError:
+            result = _batch_read([pypath])[0]
+        except (IOError, OSError):
             evaluation.message('General', 'noopen', path)
             return
 
@@ -1578,7 +1807,7 @@ class FilePrint(Builtin):
             result = result[:-1]
 
         for res in result:
-            evaluation.print_out(from_python(res))
+            evaluation.print_out(String(res))
 
         return Symbol('Null')
 
@@ -1595,32 +1824,37 @@ class Close(Builtin):
 
     >> Close[OpenWrite[]]
      = ...
+
+    #> str = StringToStream["123abc"]; Close[str];
+    #> Close[str]
+     : String is not open.
+     = Close[InputStream[String, ...]]
     """
 
     attributes = ('Protected')
      
     def apply_input(self, name, n, evaluation):
         'Close[InputStream[name_, n_]]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
 
-        if stream.closed:
+        if stream is None or stream.closed:
             evaluation.message('General', 'openx', name)
             return
 
         stream.close()
+        _close_stream(n.get_int_value())
         return name
 
     def apply_output(self, name, n, evaluation):
         'Close[OutputStream[name_, n_]]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
 
-        if stream.closed:
+        if stream is None or stream.closed:
             evaluation.message('General', 'openx', name)
             return
 
         stream.close()
+        _close_stream(n.get_int_value())
         return name
 
     def apply_default(self, stream, evaluation):
@@ -1650,10 +1884,9 @@ class StreamPosition(Builtin):
 
     def apply_input(self, name, n, evaluation):
         'StreamPosition[InputStream[name_, n_]]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
 
-        if stream.closed:
+        if stream is None or stream.closed:
             evaluation.message('General', 'openx', name)
             return
    
@@ -1662,10 +1895,9 @@ class StreamPosition(Builtin):
 
     def apply_output(self, name, n, evaluation):
         'StreamPosition[OutputStream[name_, n_]]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
 
-        if stream.closed:
+        if stream is None or stream.closed:
             evaluation.message('General', 'openx', name)
             return
 
@@ -1717,10 +1949,9 @@ class SetStreamPosition(Builtin):
 
     def apply_input(self, name, n, m, evaluation):
         'SetStreamPosition[InputStream[name_, n_], m_]'
-        global STREAMS
-        stream = STREAMS[n.to_python()]
+        stream = _get_stream(n.get_int_value())
 
-        if stream.closed:
+        if stream is None or stream.closed:
             evaluation.message('General', 'openx', name)
             return
 
@@ -1819,7 +2050,7 @@ class Skip(Read):
             return
         for i in range(py_m):
             result = super(Skip, self).apply(name, n, types, evaluation, options)
-            if result.to_python() == 'EndOfFile':
+            if result.get_name() == 'EndOfFile':
                 return Symbol('EndOfFile')
         return Symbol('Null')
 
@@ -1883,12 +2114,11 @@ class Find(Read):
 
         while True:
             tmp = super(Find, self).apply(name, n, Symbol('Record'), evaluation, options)
-            py_tmp = tmp.to_python()[1:-1]
-
-            if py_tmp == 'EndOfFile':
+            if tmp.get_name() == 'EndOfFile':
                 evaluation.message('Find', 'notfound', Expression('Find', Expression('InputStream', name, n), text))
                 return Symbol("$Failed")
 
+            py_tmp = tmp.get_string_value()
             for t in py_text:
                 if py_tmp.find(t) != -1:
                     return from_python(py_tmp)
@@ -2058,13 +2288,15 @@ class StringToStream(Builtin):
     
     def apply(self, string, evaluation):
         'StringToStream[string_]'
-        pystring = string.to_python()[1:-1]
+        if isinstance(string, String):
+            pystring = string.value
+        else:
+            pystring = string.to_python()[1:-1]
         stream = io.StringIO(unicode(pystring))
         n = _put_stream(stream)
         result = Expression('InputStream', from_python('String'), n)
 
-        global _STREAMS
-        _STREAMS[n] = result
+        _STREAMS[n - 1] = result
 
         return result
 
@@ -2078,23 +2310,20 @@ class Streams(Builtin):
 
     >> Streams[]
      = ...
+
+    #> str = StringToStream["abc"];
+    #> MemberQ[Streams[], str]
+     = True
+    #> Close[str];
+    #> MemberQ[Streams[], str]
+     = False
     """
 
     attributes = ('Protected')
 
     def apply(self, evaluation):
         'Streams[]'
-        global _STREAMS
-        global _STREAMS
-        global NSTREAMS
-
-        try:
-            _STREAMS
-        except NameError:
-            STREAMS = {}    # Python repr
-            _STREAMS = {}   # Mathics repr
-            NSTREAMS = 0    # Max stream number
-        return Expression('List', *_STREAMS.values())
+        return Expression('List', *[s for s in _STREAMS if s is not None])
 
 
 class Compress(Builtin):
@@ -2188,11 +2417,11 @@ class FileByteCount(Builtin):
 
         try:
             with mathics_open(py_filename, 'rb') as f:
-                count = 0 
-                tmp = f.read(1)
+                count = 0
+                tmp = f.read(io.DEFAULT_BUFFER_SIZE)
                 while tmp != '':
-                    count += 1
-                    tmp = f.read(1)
+                    count += len(tmp)
+                    tmp = f.read(io.DEFAULT_BUFFER_SIZE)
 
         except IOError:
             evaluation.message('General', 'noopen', filename)
@@ -2351,25 +2580,23 @@ class FileDate(Builtin):
         else:
             time_type = timetype.to_python()[1:-1]
 
+        if time_type not in ('Access', 'Creation', 'Change', 'Modification'):
+            evaluation.message('FileDate', 'datetype')
+            return
+        if time_type == 'Creation' and os.name == 'posix':
+            return Expression('Missing', 'NotApplicable')
+        if time_type == 'Change' and os.name != 'posix':
+            return Expression('Missing', 'NotApplicable')
+
+        stat = os.stat(py_path)
         if time_type == 'Access':
-            result = os.path.getatime(py_path)
-        elif time_type == 'Creation':
-            if os.name == 'posix':
-                return Expression('Missing', 'NotApplicable')
-            result = os.path.getctime(py_path)
-        elif time_type == 'Change':
-            if os.name != 'posix':
-                return Expression('Missing', 'NotApplicable')
-            result = os.path.getctime(py_path)
+            result = stat.st_atime
         elif time_type == 'Modification':
-            result = os.path.getmtime(py_path)
+            result = stat.st_mtime
         else:
-            evaluation.message('FileDate', 'datetype')
-            return
+            result = stat.st_ctime
 
-        # Offset for system epoch
-        epochtime = Expression('AbsoluteTime', time.strftime("%F %R", time.gmtime(0))).to_python(n_evaluation=evaluation)
-        result += epochtime
+        result += EPOCH_OFFSET
 
         return Expression('DateList', from_python(result))
 
@@ -2454,14 +2681,13 @@ class SetFileDate(Builtin):
             evaluation.message('SetFileDate', 'datetype')
             return
 
-        epochtime = Expression('AbsoluteTime', time.strftime("%F %R", time.gmtime(0))).evaluate(evaluation).to_python()
         stattime = Expression('AbsoluteTime', datelist).to_python(n_evaluation=evaluation)
-        stattime -= epochtime
+        stattime -= EPOCH_OFFSET
 
         try:
             stat = os.stat(py_filename)
             if py_attr == '"Access"':
-                os.utime(py_filename, (stattime, os.path.getatime(py_filename)))
+                os.utime(py_filename, (stattime, stat.st_mtime))
             if py_attr == '"Creation"':
                 if os.name == 'posix':
                     evaluation.message('SetFileDate', 'nocreationunix')
@@ -2470,7 +2696,7 @@ class SetFileDate(Builtin):
                     #TODO: Note: This is windows only
                     return Symbol('$Failed')
             if py_attr == '"Modification"':
-                os.utime(py_filename, (os.path.getatime(py_filename), stattime))
+                os.utime(py_filename, (stat.st_atime, stattime))
             if py_attr == 'All':
                 os.utime(py_filename, (stattime, stattime))
         except OSError as e:
@@ -2674,7 +2900,6 @@ class DirectoryStack(Builtin):
 
     def apply(self, evaluation):
         'DirectoryStack[]'
-        global DIRECTORY_STACK
         return from_python(DIRECTORY_STACK)
 
 
@@ -2797,7 +3022,6 @@ class ResetDirectory(Builtin):
 
     def apply(self, evaluation):
         'ResetDirectory[]'
-        global DIRECTORY_STACK
 
         try:
             tmp = DIRECTORY_STACK.pop()